@@ -0,0 +1,41 @@
+# cython: language_level=3, boundscheck=False, wraparound=False
+# distutils: extra_compile_args = -O3 -march=native
+"""
+Compiled common-bucket counting for the NumPy DRLSH sweep.
+
+Build in place with:
+cythonize -i src/algorithms/prototype_selection/_drlsh_kernel.pyx
+"""
+import numpy as np
+
+from libc.stdint cimport int32_t
+
+
+def count_common_buckets(const int32_t[:, ::1] bucket_index, Py_ssize_t current):
+    """
+    Count the hash tables in which each sample shares the bucket of a sample.
+
+    Parameters:
+    bucket_index (np.ndarray): Bucket ids of the samples in each hash table,
+    shape (n, L).
+    current (int): Row of the sample to compare against.
+
+    Returns:
+    np.ndarray: Number of common buckets of each sample, 0 for the sample itself.
+    """
+    cdef Py_ssize_t n_samples = bucket_index.shape[0]
+    cdef Py_ssize_t n_tables = bucket_index.shape[1]
+    cdef Py_ssize_t j, t
+    cdef int32_t n_common
+
+    counts = np.empty(n_samples, dtype=np.int32)
+    cdef int32_t[::1] counts_view = counts
+
+    for j in range(n_samples):
+        n_common = 0
+        for t in range(n_tables):
+            n_common += bucket_index[j, t] == bucket_index[current, t]
+        counts_view[j] = n_common
+    counts_view[current] = 0
+
+    return counts
@@ -1,8 +1,90 @@
+import warnings
+
 import numpy as np
 from sklearn.preprocessing import MinMaxScaler
 
 from src.algorithms.prototype_selection.base import BaseAlgorithm
 
+try:
+    from numba import njit
+except ImportError:  # Numba is optional, DRLSH falls back to the NumPy sweep
+    njit = None
+
+try:
+    from src.algorithms.prototype_selection._drlsh_kernel import (
+        count_common_buckets,
+    )
+except ImportError:  # The Cython kernel is optional, NumPy counts otherwise
+    count_common_buckets = None
+
+try:
+    import cupy as cp
+except ImportError:  # CuPy is optional, device="cuda" falls back to the CPU
+    cp = None
+
+
+def _sweep_class(
+    bucket_index: np.ndarray, indexes: np.ndarray, threshold: int
+) -> np.ndarray:
+    """
+    Sweep the samples of one class and collect their redundant neighbors.
+
+    Same procedure as DRLSH._sweep_class, written with explicit loops so it
+    can be compiled with Numba.
+
+    Parameters:
+    bucket_index (np.ndarray): Bucket ids of the class samples in each hash
+    table, shape (n_class, L).
+    indexes (np.ndarray): Sorted indices of the class samples in the data.
+    threshold (int): Minimum number of common buckets to remove a neighbor.
+
+    Returns:
+    np.ndarray: Indices of the removed samples.
+    """
+    n_tables = bucket_index.shape[1]
+    n_class = indexes.shape[0]
+    if n_class == 0:
+        return indexes
+
+    no_removal = indexes[n_class - 1] + 1
+    removed = np.zeros(n_class, dtype=np.bool_)
+    temporal = np.zeros(n_class, dtype=np.bool_)
+    temporal_min = no_removal
+    # Positions of the not yet compacted samples within indexes
+    positions = np.arange(n_class)
+
+    iii = 0
+    while iii < positions.shape[0]:
+        n_alive = positions.shape[0]
+        for j in range(n_alive):
+            if j == iii:
+                continue
+            n_common = 0
+            for t in range(n_tables):
+                if bucket_index[j, t] == bucket_index[iii, t]:
+                    n_common += 1
+            if n_common > 0 and n_common >= threshold:
+                removed[positions[j]] = True
+                temporal[positions[j]] = True
+                if indexes[positions[j]] < temporal_min:
+                    temporal_min = indexes[positions[j]]
+
+        if (
+            iii + 1 < n_alive and temporal_min <= indexes[positions[iii + 1]]
+        ) or iii > 2000:
+            keep = np.nonzero(~temporal[positions])[0]
+            positions = positions[keep][iii:]
+            bucket_index = bucket_index[keep][iii:]
+            temporal[:] = False
+            temporal_min = no_removal
+            iii = 0
+        iii += 1
+
+    return indexes[removed]
+
+
+_sweep_class_jit = njit(cache=True)(_sweep_class) if njit is not None else None
+
 
 class DRLSH(BaseAlgorithm):
     def __init__(
@@ -11,12 +93,126 @@ class DRLSH(BaseAlgorithm):
         L=30,  # Number of hash tables
         W=1,  # Bucket size
         ST=6,
+        device="cpu",  # "cpu", or "cuda" to hash on the GPU (requires CuPy)
     ):
         super().__init__()
+        if device not in ("cpu", "cuda"):
+            raise ValueError(f"Unknown device {device!r}, use 'cpu' or 'cuda'.")
         self.M = M
         self.L = L
         self.W = W
         self.ST = ST
+        self.device = device
+
+    def _index_bucket_members(self, Bucket_Index_Decimal_All_Class: np.ndarray):
+        """
+        Group the class samples by the bucket they fall in within each table.
+
+        Parameters:
+        Bucket_Index_Decimal_All_Class (np.ndarray): Bucket ids of the class
+        samples in each hash table, shape (n_class, L).
+
+        Returns:
+        tuple: Rows of the class samples sorted by (bucket, table), and the start
+        and end of the run of each sample's bucket in that order, both of shape
+        (n_class, L).
+        """
+        n_tables = Bucket_Index_Decimal_All_Class.shape[1]
+        # Ids are shared by all tables, so tag them with the table to keep the
+        # buckets of different tables apart
+        Bucket_Keys = Bucket_Index_Decimal_All_Class.astype(np.int64) * n_tables
+        Bucket_Keys += np.arange(n_tables)
+        Order = np.argsort(Bucket_Keys, axis=None, kind="stable")
+        Sorted_Keys = Bucket_Keys.ravel()[Order]
+        Bucket_Members = Order // n_tables
+        Bucket_Starts = np.searchsorted(Sorted_Keys, Bucket_Keys, side="left")
+        Bucket_Ends = np.searchsorted(Sorted_Keys, Bucket_Keys, side="right")
+        return Bucket_Members, Bucket_Starts, Bucket_Ends
+
+    def _sweep_class(
+        self, Bucket_Index_Decimal_All_Class: np.ndarray, All_Indexes: np.ndarray
+    ) -> np.ndarray:
+        """
+        Sweep the samples of one class and collect their redundant neighbors.
+
+        Parameters:
+        Bucket_Index_Decimal_All_Class (np.ndarray): Bucket ids of the class
+        samples in each hash table, shape (n_class, L).
+        All_Indexes (np.ndarray): Sorted indices of the class samples in the data.
+
+        Returns:
+        np.ndarray: Indices of the removed samples.
+        """
+        Frequency_Neighbors_Threshold = self.ST
+        # Bitmaps over the data of all removed samples and of the samples
+        # removed since the last compaction
+        Removed_Samples = np.zeros(self.X.shape[0], dtype=bool)
+        Temporal_Removed_Samples = np.zeros(self.X.shape[0], dtype=bool)
+        iii = 0
+        TRS = self.X.shape[0] + 1
+        Temporal_Min = TRS
+        # Without the compiled kernel, look the neighbors up in the buckets of
+        # the current sample instead of scanning the whole class
+        use_members = count_common_buckets is None
+        if use_members:
+            Bucket_Members, Bucket_Starts, Bucket_Ends = self._index_bucket_members(
+                Bucket_Index_Decimal_All_Class
+            )
+            # Rows of the not yet compacted samples in the member index
+            Positions = np.arange(len(All_Indexes))
+        while iii < len(All_Indexes):
+            if use_members:
+                Current_Position = Positions[iii]
+                Neighbors = np.concatenate(
+                    [
+                        Bucket_Members[start:end]
+                        for start, end in zip(
+                            Bucket_Starts[Current_Position],
+                            Bucket_Ends[Current_Position],
+                        )
+                    ]
+                )
+                Number_of_Common_Buckets = np.bincount(
+                    Neighbors, minlength=len(Bucket_Starts)
+                )
+                # A sample is not its own neighbor
+                Number_of_Common_Buckets[Current_Position] = 0
+                Number_of_Common_Buckets = Number_of_Common_Buckets[Positions]
+            else:
+                Number_of_Common_Buckets = count_common_buckets(
+                    Bucket_Index_Decimal_All_Class, iii
+                )
+            Index_Neighbors = Number_of_Common_Buckets > 0
+            Frequency_Neighbors = Number_of_Common_Buckets[Index_Neighbors]
+            uniqued_Neighbors = All_Indexes[Index_Neighbors]
+            Removed_Samples_Current = uniqued_Neighbors[
+                Frequency_Neighbors >= Frequency_Neighbors_Threshold
+            ]
+            Removed_Samples[Removed_Samples_Current] = True
+
+            Temporal_Removed_Samples[Removed_Samples_Current] = True
+            if len(Removed_Samples_Current) > 0:
+                # All_Indexes is sorted, so the first one is the smallest
+                Temporal_Min = min(Temporal_Min, Removed_Samples_Current[0])
+            if (
+                len(All_Indexes) > iii + 1 and Temporal_Min <= All_Indexes[iii + 1]
+            ) or (iii > 2000):
+                aa = Temporal_Removed_Samples[All_Indexes]
+                Temporal_Removed_Samples[All_Indexes[aa]] = False
+                Temporal_Min = TRS
+                All_Indexes = All_Indexes[~aa]
+                Keep_Rows = ~aa
+                All_Indexes = All_Indexes[iii:]
+                if use_members:
+                    Positions = Positions[Keep_Rows][iii:]
+                else:
+                    Bucket_Index_Decimal_All_Class = Bucket_Index_Decimal_All_Class[
+                        Keep_Rows
+                    ][iii:]
+                iii = 0
+            iii += 1
+
+        return np.flatnonzero(Removed_Samples)
 
     def _fit(self) -> np.ndarray:
         self.M = int(self.X.shape[0] ** (1 / 7))
@@ -36,88 +232,64 @@ class DRLSH(BaseAlgorithm):
         )  # Generate a in floor((ax+b)/W)
         b = self.W * np.random.rand(self.M * self.L, 1)  # Generate b in floor((ax+b)/W)
 
-        # Calculating the buckets of samples
-        Bucket_Index_Decimal_All = np.zeros((self.L, Data.shape[0]), dtype=np.int32)
-        for i in range(self.L):
-            j = slice((i * self.M), ((i + 1) * self.M))
-            Bucket_Index = np.floor((a[j] @ Data[:, :-1].T + b[j]) / self.W).astype(
-                np.int16
+        use_gpu = self.device == "cuda" and cp is not None
+        if self.device == "cuda" and not use_gpu:
+            warnings.warn("CuPy is not installed, DRLSH falls back to the CPU.")
+
+        # Project with all hash functions at once, shape (L, M, n)
+        n = Data.shape[0]
+        if use_gpu:
+            Projection = cp.asnumpy(
+                cp.floor(
+                    (cp.asarray(a) @ cp.asarray(Data[:, :-1]).T + cp.asarray(b))
+                    / self.W
+                )
             )
-            BI = Bucket_Index
-
-            Bucket_Index_uniqued = np.unique(BI.T, axis=0).T
-
-            # For splitting BI matrix into PartsNo to make the search faster
-            ss = 0
-            vectLength = BI.shape[1]
-            splitsize = vectLength
-
-            idxs = slice(0, splitsize)
-            BI_Part = BI[:, idxs]
-            Bucket_Index_Decimal = np.where(
-                (BI_Part.T[:, None] == Bucket_Index_uniqued.T[None, :]).all(axis=2)
-            )[1]
-            Bucket_Index_Decimal = Bucket_Index_Decimal.astype(np.int32)
-            Bucket_Index_Decimal_All[i, ss : ss + Bucket_Index_Decimal.shape[0]] = (
-                Bucket_Index_Decimal
+        else:
+            Projection = np.floor((a @ Data[:, :-1].T + b) / self.W)
+        Bucket_Index_All = Projection.astype(np.int16).reshape(self.L, self.M, n)
+
+        # Pack the M hash values of each table into 64-bit keys, four 16-bit
+        # values per lane, so a bucket is identified by ceil(M / 4) integers
+        n_lanes = -(-self.M // 4)
+        Bucket_Index_Padded = np.zeros((self.L, n_lanes * 4, n), dtype=np.uint64)
+        Bucket_Index_Padded[:, : self.M] = Bucket_Index_All.view(np.uint16)
+        Shifts = (16 * np.arange(4, dtype=np.uint64))[:, None]
+        Bucket_Keys = np.bitwise_or.reduce(
+            Bucket_Index_Padded.reshape(self.L, n_lanes, 4, n) << Shifts, axis=2
+        )
+        Bucket_Keys = Bucket_Keys.transpose(2, 0, 1).reshape(n * self.L, n_lanes)
+
+        # Calculating the buckets of samples, one row of table ids per sample.
+        # Ids are only compared within the same table, so all tables can share
+        # one id space
+        if n_lanes == 1:
+            _, Bucket_Index_Decimal = np.unique(Bucket_Keys[:, 0], return_inverse=True)
+        else:
+            _, Bucket_Index_Decimal = np.unique(
+                Bucket_Keys, axis=0, return_inverse=True
             )
-            ss += Bucket_Index_Decimal.shape[0]
+        Bucket_Index_Decimal_All = Bucket_Index_Decimal.reshape(n, self.L).astype(
+            np.int32
+        )
 
-        Removed_Samples_Index_ALL = []
-        RSC = 0
+        Removed_Samples = np.zeros(n, dtype=bool)
         for classID in Classes:
             All_Indexes = np.where(Data[:, -1] == classID)[0]
-            Bucket_Index_Decimal_All_Class = Bucket_Index_Decimal_All[:, All_Indexes]
-            iii = 0
-            TRS = Data.shape[0] + 1
-            Temporal_Removed_Samples = [TRS]
-            while iii < len(All_Indexes):
-                Current_Sample_Bucket_Index_Decimal = Bucket_Index_Decimal_All_Class[
-                    :, iii
-                ].copy()
-                Bucket_Index_Decimal_All_Class[:, iii] = -1
-                Number_of_Common_Buckets = np.sum(
-                    Bucket_Index_Decimal_All_Class
-                    == Current_Sample_Bucket_Index_Decimal[:, np.newaxis],
-                    axis=0,
+            Bucket_Index_Decimal_All_Class = Bucket_Index_Decimal_All[All_Indexes]
+            if _sweep_class_jit is not None:
+                Removed_Samples_Class = _sweep_class_jit(
+                    Bucket_Index_Decimal_All_Class,
+                    All_Indexes,
+                    Frequency_Neighbors_Threshold,
                 )
-                Index_Neighbors = Number_of_Common_Buckets > 0
-                Frequency_Neighbors = Number_of_Common_Buckets[Index_Neighbors]
-                uniqued_Neighbors = All_Indexes[Index_Neighbors]
-                Bucket_Index_Decimal_All_Class[:, iii] = (
-                    Current_Sample_Bucket_Index_Decimal
+            else:
+                Removed_Samples_Class = self._sweep_class(
+                    Bucket_Index_Decimal_All_Class, All_Indexes
                 )
-                Removed_Samples_Current = uniqued_Neighbors[
-                    Frequency_Neighbors >= Frequency_Neighbors_Threshold
-                ]
-                Removed_Samples_Index_ALL += Removed_Samples_Current.tolist()
-
-                Temporal_Removed_Samples.extend(Removed_Samples_Current)
-                if (
-                    len(All_Indexes) > iii + 1
-                    and min(Temporal_Removed_Samples) <= All_Indexes[iii + 1]
-                ) or (iii > 2000):
-                    aa = np.isin(All_Indexes, Temporal_Removed_Samples)
-                    All_Indexes = All_Indexes[~aa]
-                    Bucket_Index_Decimal_All_Class = Bucket_Index_Decimal_All_Class[
-                        :, ~aa
-                    ]
-                    Temporal_Removed_Samples = [TRS]
-                    All_Indexes = All_Indexes[iii:]
-                    Bucket_Index_Decimal_All_Class = Bucket_Index_Decimal_All_Class[
-                        :, iii:
-                    ]
-                    iii = 0
-                iii += 1
-
-        Removed_Samples_Index_ALL = np.unique(Removed_Samples_Index_ALL)
-        # Remove -1
-        Removed_Samples_Index_ALL = Removed_Samples_Index_ALL[
-            Removed_Samples_Index_ALL != -1
-        ]
-        Selected_Data_Index = np.setdiff1d(
-            np.arange(Data.shape[0]), Removed_Samples_Index_ALL
-        )
+            Removed_Samples[Removed_Samples_Class] = True
+
+        Selected_Data_Index = np.flatnonzero(~Removed_Samples)
 
         return Selected_Data_Index
 
@@ -4,15 +4,39 @@ from src.algorithms.prototype_selection.base import BaseAlgorithm
 from src.algorithms.prototype_selection.enn import ENN
 
 
+def _euclidean_distances_squared(X: np.ndarray) -> np.ndarray:
+    """
+    Compute the squared Euclidean distance matrix via ||x||^2 + ||y||^2 - 2xy^T.
+
+    Parameters:
+    X (np.ndarray): Data matrix.
+
+    Returns:
+    np.ndarray: Squared pairwise distances.
+    """
+    sq_norms = np.einsum("ij,ij->i", X, X)
+    # Add the norms before the Gram term so the result is exactly symmetric,
+    # otherwise an instance could appear closer to its nearest enemy than
+    # the enemy distance itself
+    distances = sq_norms[:, None] + sq_norms[None, :]
+    distances -= 2 * (X @ X.T)
+    # Clip negative values caused by floating point cancellation
+    np.maximum(distances, 0, out=distances)
+    return distances
+
+
 class ICF(BaseAlgorithm):
     """
     Iterative case filtering (ICF)
     """
 
-    def __init__(self, n_neighbors: int = 3, metric="euclidean"):
+    def __init__(
+        self, n_neighbors: int = 3, metric="euclidean", block_size: int = 4096
+    ):
         super().__init__()
         self.metric = metric
         self.n_neighbors = n_neighbors
+        self.block_size = block_size
         self.mask: np.ndarray = None
         self.distance_nearest_enemy: np.ndarray = None
         self.pairwise_distance: np.ndarray = None
@@ -22,68 +46,30 @@ class ICF(BaseAlgorithm):
         Set the minimum distance to the nearest enemy for each instance.
         """
 
-        self.distance_nearest_enemy = np.full(self.X_.shape[0], np.inf)
+        n_samples = self.X_.shape[0]
+        self.distance_nearest_enemy = np.empty(n_samples)
 
-        for idx in range(self.X_.shape[0]):
-            for idx2 in range(self.X_.shape[0]):
-                if (
-                    self.y_[idx] != self.y_[idx2]
-                    and self.pairwise_distance[idx, idx2]
-                    < self.distance_nearest_enemy[idx]
-                ):
-                    self.distance_nearest_enemy[idx] = self.pairwise_distance[idx, idx2]
+        # Process rows in blocks to bound the size of the masked copy
+        for start in range(0, n_samples, self.block_size):
+            stop = min(start + self.block_size, n_samples)
+            enemy_mask = self.y_[start:stop, None] != self.y_[None, :]
+            self.distance_nearest_enemy[start:stop] = np.where(
+                enemy_mask, self.pairwise_distance[start:stop], np.inf
+            ).min(axis=1)
 
-    def _adaptable(self, idx: int, idx2: int) -> bool:
+    def _get_adaptable_matrix(self) -> np.ndarray:
         """
-        Check if an instance is adaptable to another instance.
-
-        Parameters:
-        idx (int): Index of the first instance.
-        idx2 (int): Index of the second instance.
+        Get the adaptability matrix of the current instances.
 
         Returns:
-        bool: True if the instance is adaptable, False otherwise.
+        np.ndarray: Boolean matrix where entry (idx, idx2) is True if instance
+        idx is adaptable to instance idx2, i.e. idx lies closer to idx2 than
+        the nearest enemy of idx2. Self-pairs are excluded.
         """
         # TODO: Check if nearest enemy if for idx or idx2
-        return self.pairwise_distance[idx, idx2] < self.distance_nearest_enemy[idx2]
-
-    def _get_coverage(self, idx: int) -> int:
-        """
-        Get the number of instances covered by a given instance.
-
-        Parameters:
-        idx (int): Index of the instance.
-
-        Returns:
-        int: Number of instances covered.
-        """
-        len_coverage = 0
-
-        for idx2 in range(self.X_.shape[0]):
-            if idx2 != idx and self.mask[idx2]:
-                if self._adaptable(idx, idx2):
-                    len_coverage += 1
-
-        return len_coverage
-
-    def _get_reachable(self, idx: int) -> int:
-        """
-        Get the number of reachable instances for a given instance.
-
-        Parameters:
-        idx (int): Index of the instance.
-
-        Returns:
-        int: Number of reachable instances.
-        """
-        len_reachable = 0
-
-        for idx2 in range(self.X_.shape[0]):
-            if idx2 != idx and self.mask[idx2]:
-                if self._adaptable(idx2, idx):
-                    len_reachable += 1
-
-        return len_reachable
+        adaptable = self.pairwise_distance < self.distance_nearest_enemy[None, :]
+        np.fill_diagonal(adaptable, False)
+        return adaptable
 
     def _fit(self) -> np.ndarray:
         """
@@ -94,31 +80,41 @@ class ICF(BaseAlgorithm):
         """
         S = ENN(self.n_neighbors).fit(self.X, self.y).sample_indices_
 
+        # Compute the distances once and slice them for the surviving set
+        if self.metric == "euclidean":
+            # ICF only compares distances, so stay in squared-distance space
+            distances = _euclidean_distances_squared(self.X[S])
+        else:
+            distances = pairwise_distances(self.X[S], metric=self.metric)
+        # Single precision is enough to compare distances and halves the
+        # memory traffic of the O(n^2) reductions
+        distances = distances.astype(np.float32, copy=False)
+
+        # Positions of the surviving instances within S
+        keep = np.arange(len(S))
         progress = True
 
         while progress:
-            self.X_ = self.X[S]
-            self.y_ = self.y[S]
+            self.X_ = self.X[S[keep]]
+            self.y_ = self.y[S[keep]]
 
-            self.pairwise_distance = pairwise_distances(self.X_, metric=self.metric)
+            self.pairwise_distance = distances[np.ix_(keep, keep)]
 
             self._set_distance_nearest_enemy()
 
             self.mask = np.ones(len(self.X_), dtype=bool)
 
-            reachable, coverage = np.zeros(len(self.X_)), np.zeros(len(self.X_))
-            for idx in range(self.X_.shape[0]):
-                if self.mask[idx]:
-                    coverage[idx] = self._get_coverage(idx)
-                    reachable[idx] = self._get_reachable(idx)
-
-            progress = False
+            # Row idx of the adaptability matrix is the coverage set of idx,
+            # column idx is its reachable set
+            adaptable = self._get_adaptable_matrix()
+            mask = self.mask.astype(np.int32)
+            coverage = adaptable.dot(mask)
+            reachable = adaptable.T.dot(mask)
 
-            for idx in range(self.X_.shape[0]):
-                if self.mask[idx] and reachable[idx] > coverage[idx]:
-                    self.mask[idx] = False
-                    progress = True
+            removed = self.mask & (reachable > coverage)
+            progress = bool(removed.any())
+            self.mask[removed] = False
 
-            S = S[self.mask]
+            keep = keep[self.mask]
 
-        return S
+        return S[keep]
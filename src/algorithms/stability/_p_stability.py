@@ -1,6 +1,8 @@
 import itertools
+import math
 from typing import Iterator, Optional, Tuple
 import numpy as np
+from joblib import Parallel, delayed, effective_n_jobs
 from sklearn.model_selection import StratifiedKFold
 from sklearn.neighbors import KNeighborsClassifier
 from tqdm import tqdm
@@ -55,7 +57,15 @@ class PStability:
 
         self._selected_indices: np.ndarray = np.arange(self.n_samples)
 
-        self.base_accuracy = self._get_accuracy()
+        # Fit once on the full training set, removals are simulated by
+        # skipping removed samples in the precomputed neighbor lists
+        self._knn = self.model(n_neighbors=self.n_neighbors)
+        self._knn.fit(self.X_train, self.y_train)
+        self._y_train_encoded = np.searchsorted(self.classes, self.y_train)
+        self._test_neighbors: Optional[np.ndarray] = None
+        self._test_neighbor_votes: Optional[np.ndarray] = None
+        self.base_accuracy: Optional[float] = None
+        self._set_test_neighbors(0)
 
         self.show_progress = show_progress
         self.n_jobs = n_jobs if n_jobs is not None else mp.cpu_count()
@@ -63,34 +73,98 @@ class PStability:
             batch_size if batch_size is not None else min(1000, self.n_samples)
         )
 
+    def _set_test_neighbors(self, max_p: int) -> None:
+        """
+        Query enough nearest training samples of each test sample to classify it
+        after removing up to max_p training samples.
+
+        Neighbors are ordered by distance, then by training index, so the
+        order does not depend on how many neighbors are queried. The base
+        accuracy is recomputed from the new table.
+
+        Args:
+            max_p (int): Maximum number of samples that will be removed.
+        """
+        n_neighbors = min(self.n_neighbors + max_p, self.n_samples)
+        if (
+            self._test_neighbors is not None
+            and self._test_neighbors.shape[1] >= n_neighbors
+        ):
+            return
+
+        # Query past the width until the next neighbor of every test sample is
+        # strictly farther, so all samples tied at the boundary are included
+        n_queried = n_neighbors
+        while True:
+            n_queried = min(2 * n_queried, self.n_samples)
+            distances, neighbors = self._knn.kneighbors(
+                self.X_test, n_neighbors=n_queried
+            )
+            if n_queried == self.n_samples or np.all(
+                distances[:, -1] > distances[:, n_neighbors - 1]
+            ):
+                break
+        order = np.lexsort((neighbors, distances))
+        self._test_neighbors = np.take_along_axis(neighbors, order, axis=1)[
+            :, :n_neighbors
+        ]
+        # Flat (test sample, class) vote index of each neighbor
+        self._test_neighbor_votes = (
+            np.arange(len(self.X_test))[:, None] * self.n_classes
+            + self._y_train_encoded[self._test_neighbors]
+        )
+        self.base_accuracy = self._score_mask(np.zeros(self.n_samples, dtype=bool))
+
     def _get_accuracy(self) -> float:
         """
-        Train the KNN model on the selected indices and return the accuracy on the test set.
+        Return the test accuracy of the KNN model trained on the selected indices.
+
+        The model is not refitted, the neighbors of each test sample are its
+        first n_neighbors precomputed neighbors that are still selected.
 
         Returns:
             float: Accuracy of the model on the test set.
         """
-        knn = self.model(n_neighbors=self.n_neighbors)
-        knn.fit(
-            self.X_train[self._selected_indices], self.y_train[self._selected_indices]
-        )
-        return knn.score(self.X_test, self.y_test)
+        removed = np.ones(self.n_samples, dtype=bool)
+        removed[self._selected_indices] = False
+        return self._score_mask(removed)
 
-    def _check_accuracy_drop(
-        self, selected_indices: np.ndarray, epsilon: float
-    ) -> bool:
+    def _score_mask(self, removed: np.ndarray) -> float:
         """
-        Check if the accuracy drops below a specified epsilon for the given selected indices.
+        Return the test accuracy of the KNN model after removing training samples.
 
         Args:
-            selected_indices (np.ndarray): Indices of the samples to use for training.
+            removed (np.ndarray): Boolean mask of the removed training samples.
+
+        Returns:
+            float: Accuracy of the model on the test set.
+        """
+        alive = ~removed[self._test_neighbors]
+        # Rank of each surviving neighbor, the first n_neighbors of them vote
+        voting = alive & (np.cumsum(alive, axis=1) <= self.n_neighbors)
+
+        n_test = len(self.X_test)
+        votes = np.bincount(
+            self._test_neighbor_votes[voting], minlength=n_test * self.n_classes
+        ).reshape(n_test, self.n_classes)
+        # Ties go to the smallest class, as in KNeighborsClassifier
+        y_pred = self.classes[votes.argmax(axis=1)]
+        return np.mean(y_pred == self.y_test)
+
+    def _check_accuracy_drop(self, removed_indices: np.ndarray, epsilon: float) -> bool:
+        """
+        Check if the accuracy drops below a specified epsilon for the given removed indices.
+
+        Args:
+            removed_indices (np.ndarray): Indices of the samples to remove from training.
             epsilon (float): Allowed drop in accuracy.
 
         Returns:
             bool: True if accuracy drops below epsilon, False otherwise.
         """
-        self._selected_indices = selected_indices
-        return self._get_accuracy() < self.base_accuracy - epsilon
+        removed = np.zeros(self.n_samples, dtype=bool)
+        removed[removed_indices] = True
+        return self._score_mask(removed) < self.base_accuracy - epsilon
 
     def _worker_find_maximum_p(self, batch: list[np.ndarray], epsilon: float) -> int:
         """
@@ -100,8 +174,8 @@ class PStability:
         If return batch size means no accuracy drop.
         """
         try:
-            for selected_indices in batch:
-                if self._check_accuracy_drop(selected_indices, epsilon):
+            for removed_indices in batch:
+                if self._check_accuracy_drop(removed_indices, epsilon):
                     return -1  # Indicate that the accuracy drop was detected
             return len(batch)
         except Exception as e:
@@ -134,6 +208,9 @@ class PStability:
             pbar.update(ret)
 
         for p in range(1, max_limit + 1):
+            # Widen the neighbor table only as far as the search goes, it is
+            # pickled with self into every batch
+            self._set_test_neighbors(p)
             if self._evaluate_p_value(p, epsilon, terminate_flag, update_callback):
                 return p - 1
 
@@ -159,10 +236,15 @@ class PStability:
             bool: True if termination is needed, False otherwise.
         """
         logger.debug(f"Finding Maximum p, Evaluating p={p}")
-        combination_generator = CombinationGenerator().configure(
-            self.n_samples, self.n_samples - p
-        )
-        total_combinations = len(combination_generator)
+        # The accuracy after removing a set only depends on its samples that
+        # are among the candidates. A set with fewer than p candidates thus
+        # behaves like a smaller set, already checked for a smaller p.
+        candidates = self._removal_candidates(p)
+        if len(candidates) < p:
+            return False
+
+        combinations = self._removal_combinations(candidates, p)
+        total_combinations = math.comb(len(candidates), p)
 
         with mp.Pool(processes=self.n_jobs) as pool:
             with tqdm(
@@ -172,7 +254,7 @@ class PStability:
                 disable=not self.show_progress,
             ) as pbar:
                 for batch in self._batch_combinations(
-                    combination_generator, min(self.batch_size, 1000)
+                    combinations, min(self.batch_size, 1000)
                 ):
                     if terminate_flag.value == 1:
                         pool.terminate()
@@ -189,7 +271,43 @@ class PStability:
 
                 pool.close()
                 pool.join()
-        return False
+        # Drops found by the last batches are only reported after the join
+        return terminate_flag.value == 1
+
+    def _removal_candidates(self, p: int) -> np.ndarray:
+        """
+        Get the training samples whose removal can change a test prediction
+        when p samples are removed.
+
+        A test prediction only depends on its first n_neighbors surviving
+        training samples. With p samples removed, removing any sample beyond
+        its n_neighbors + p - 1 nearest ones cannot change them. This relies
+        on the neighbors being ranked by (distance, training index), so that
+        ties at the boundary are broken the same way with and without removals.
+
+        Args:
+            p (int): Number of samples to remove.
+
+        Returns:
+            np.ndarray: Sorted indices of the candidate training samples.
+        """
+        return np.unique(self._test_neighbors[:, : self.n_neighbors + p - 1])
+
+    def _removal_combinations(
+        self, candidates: np.ndarray, p: int
+    ) -> Iterator[np.ndarray]:
+        """
+        Generate each combination of p candidates to remove.
+
+        Args:
+            candidates (np.ndarray): Indices of the candidate training samples.
+            p (int): Number of samples to remove.
+
+        Yields:
+            np.ndarray: Indices of the samples to remove from training.
+        """
+        for removed in itertools.combinations(candidates, p):
+            yield np.array(removed)
 
     def _compute_decrease(self, selected_indices: np.ndarray) -> float:
         """
@@ -273,6 +391,8 @@ class PStability:
         Returns:
             tuple[float, float]: Maximum and average epsilon values.
         """
+        self._set_test_neighbors(p)
+
         combination_generator = CombinationGenerator().configure(
             self.n_samples, self.n_samples - p
         )
@@ -373,6 +493,71 @@ class PStabilityResults:
         return None
 
 
+def _run_fold(
+    X: np.ndarray,
+    y: np.ndarray,
+    train_index: np.ndarray,
+    test_index: np.ndarray,
+    n_neighbors: int,
+    find_max_p: bool,
+    find_epsilon: list[int],
+    show_progress: bool,
+    n_jobs: Optional[int],
+    batch_size: Optional[int],
+) -> Tuple[Optional[int], list[float], list[float]]:
+    """
+    Run the PStability algorithm on a single cross-validation fold.
+
+    Parameters:
+    X (np.ndarray): Feature matrix of the dataset.
+    y (np.ndarray): Labels of the dataset.
+    train_index (np.ndarray): Indices of the training samples of the fold.
+    test_index (np.ndarray): Indices of the test samples of the fold.
+    n_neighbors (int): Number of neighbors for k-NN.
+    find_max_p (bool): Whether to find the maximum p value.
+    find_epsilon (list[int]): list of p values to find the epsilon value.
+    show_progress (bool): Whether to use tqdm for progress tracking.
+    n_jobs (int): Number of parallel jobs to run inside the fold.
+    batch_size (int): Size of each batch for parallel processing.
+
+    Returns:
+    Tuple[Optional[int], list[float], list[float]]: Maximum p value (None if not
+    requested), and maximum and average epsilon for each p.
+    """
+    X_train, X_test = X[train_index], X[test_index]
+    y_train, y_test = y[train_index], y[test_index]
+
+    p_stability = PStability(
+        X_train,
+        y_train,
+        X_test,
+        y_test,
+        n_neighbors=n_neighbors,
+        show_progress=show_progress,
+        n_jobs=n_jobs,
+        batch_size=batch_size,
+    )
+
+    max_p_value = None
+    if find_max_p:
+        max_p_value = p_stability.find_maximum_p()
+        logger.debug(
+            f"Fold p={max_p_value}: max_p={max_p_value}", extra={"use_tqdm": True}
+        )
+
+    max_epsilon, avg_epsilon = [], []
+    for p in find_epsilon:
+        tmp_max, tmp_avg = p_stability.find_epsilon(p)
+        max_epsilon.append(tmp_max)
+        avg_epsilon.append(tmp_avg)
+        logger.debug(
+            f"Fold p={p}: max_epsilon={tmp_max}, avg_epsilon={tmp_avg}",
+            extra={"use_tqdm": True},
+        )
+
+    return max_p_value, max_epsilon, avg_epsilon
+
+
 def run_p_stability(
     X: np.ndarray,
     y: np.ndarray,
@@ -383,6 +568,7 @@ def run_p_stability(
     show_progress: bool = False,
     n_jobs: Optional[int] = None,
     batch_size: Optional[int] = None,
+    n_fold_jobs: int = -1,
 ) -> PStabilityResults:
     """
     Run the PStability algorithm on the given dataset using k-fold cross-validation.
@@ -396,11 +582,12 @@ def run_p_stability(
     find_max_p (bool): Whether to find the maximum p value. Default is False.
     find_epsilon (list[int], optional): list of p values to find the epsilon value. Default is None.
     show_progress (bool): Whether to use tqdm for progress tracking. Default is False.
-    n_jobs (int): Number of parallel jobs to run. Default is None which uses all CPU cores.
+    n_jobs (int): Number of parallel jobs to run inside each fold. Default is None which shares all CPU cores between the parallel folds.
     batch_size (int): Size of each batch for parallel processing. Default is None which sets it to 1000 or number of samples.
+    n_fold_jobs (int): Number of folds to run in parallel. Default is -1 which runs all folds in parallel, 1 runs them sequentially.
 
     Returns:
-    PStabilityResults: Object containing max_p, max_epsilon, and avg_epsilon values, along with the total time taken.
+    PStabilityResults: Object containing max_p, max_epsilon, and avg_epsilon values, along with the wall-clock time taken by all folds.
     """
     if find_epsilon is None:
         find_epsilon = []
@@ -411,58 +598,60 @@ def run_p_stability(
         )
 
     kf = StratifiedKFold(n_splits=n_folds, shuffle=True, random_state=42)
+
+    # Folds are independent, split the cores between the parallel folds
+    n_parallel_folds = min(effective_n_jobs(n_fold_jobs), n_folds)
+    if n_jobs is None:
+        n_jobs = max(1, mp.cpu_count() // n_parallel_folds)
+    # The bars of folds running side by side would interleave, only keep the
+    # fold progress bar then
+    show_fold_progress = show_progress and n_parallel_folds == 1
+
+    start_time = time.time()
+
+    # X and y are passed whole so joblib memory-maps them once for all folds
+    fold_results = Parallel(n_jobs=n_parallel_folds, return_as="generator")(
+        delayed(_run_fold)(
+            X,
+            y,
+            train_index,
+            test_index,
+            n_neighbors,
+            find_max_p,
+            find_epsilon,
+            show_fold_progress,
+            n_jobs,
+            batch_size,
+        )
+        for train_index, test_index in kf.split(X, y)
+    )
+
     max_p = []
     max_epsilon = [[] for _ in find_epsilon]
     avg_epsilon = [[] for _ in find_epsilon]
-    time_taken = []
 
-    for train_index, test_index in tqdm(
-        kf.split(X, y),
+    for fold_max_p, fold_max_epsilon, fold_avg_epsilon in tqdm(
+        fold_results,
         total=n_folds,
         desc="K-Fold progress",
         leave=False,
         disable=not show_progress,
     ):
-        X_train, X_test = X[train_index], X[test_index]
-        y_train, y_test = y[train_index], y[test_index]
-
-        p_stability = PStability(
-            X_train,
-            y_train,
-            X_test,
-            y_test,
-            n_neighbors=n_neighbors,
-            show_progress=show_progress,
-            n_jobs=n_jobs,
-            batch_size=batch_size,
-        )
-
-        start_time = time.time()
         if find_max_p:
-            max_p_value = p_stability.find_maximum_p()
-            max_p.append(max_p_value)
-            logger.debug(
-                f"Fold p={max_p_value}: max_p={max_p_value}", extra={"use_tqdm": True}
-            )
-
-        for i, p in enumerate(find_epsilon):
-            tmp_max, tmp_avg = p_stability.find_epsilon(p)
-            max_epsilon[i].append(tmp_max)
-            avg_epsilon[i].append(tmp_avg)
-            logger.debug(
-                f"Fold p={p}: max_epsilon={tmp_max}, avg_epsilon={tmp_avg}",
-                extra={"use_tqdm": True},
-            )
-        time_taken.append(time.time() - start_time)
+            max_p.append(fold_max_p)
+        for i in range(len(find_epsilon)):
+            max_epsilon[i].append(fold_max_epsilon[i])
+            avg_epsilon[i].append(fold_avg_epsilon[i])
+    # Folds may overlap, so report the elapsed time rather than their sum
+    elapsed_time = time.time() - start_time
 
     max_p_value = np.min(max_p) if find_max_p else None
     max_epsilon_values = np.max(max_epsilon, axis=1) if find_epsilon else None
     avg_epsilon_values = np.mean(avg_epsilon, axis=1) if find_epsilon else None
-    sum_time = np.sum(time_taken)
 
     return PStabilityResults(
         max_p=max_p_value,
         max_epsilon=max_epsilon_values,
         avg_epsilon=avg_epsilon_values,
-        time=sum_time,
+        time=elapsed_time,
     )
@@ -132,9 +132,7 @@ class DatasetResult:
     def print_tabulated(self):
         from tabulate import tabulate
 
-        table = []
-        for algorithm in self.results:
-            table.append(self.results[algorithm].format_list())
+        table = [result.format_list() for result in self.results.values()]
 
         headers = [
             "Algorithm",
@@ -162,18 +160,13 @@ class DatasetResult:
         )
 
     def ecxel_content(self):
-        tmp_content = {}
-        for algorithm in self.results:
-            tmp_content[algorithm] = self.results[algorithm].format_dict()
+        # Build the metric columns in a single pass over the algorithms
+        content = {}
+        for result in self.results.values():
+            for metric, value in result.format_dict().items():
+                content.setdefault(metric, []).append(value)
 
-        metrics = list(tmp_content[list(tmp_content.keys())[0]].keys())
-
-        return {
-            **{
-                metric: [tmp_content[algorithm][metric] for algorithm in tmp_content]
-                for metric in metrics
-            },
-        }
+        return content
 
     def load_jsonl(self, filename, line=-1):
         """
@@ -7,6 +7,34 @@ import numpy as np
 from config import FIGURE_PATH, LOG_PATH
 
 
+def _plot_one(ax, X, y, marker_properties, alpha):
+    """
+    Scatter a 2D dataset on the given axis, one collection per class.
+
+    Parameters:
+    ax (matplotlib.axes.Axes): Axis to plot on.
+    X (numpy.ndarray): Feature matrix.
+    y (numpy.ndarray): Labels.
+    marker_properties (dict): Marker properties for each class.
+    alpha (float): Transparency level for markers.
+    """
+    for label in np.unique(y):
+        props = marker_properties[label]
+        X_label = X[y == label]
+        ax.scatter(
+            X_label[:, 0],
+            X_label[:, 1],
+            label=f"Class {label}",
+            marker=props["marker"],
+            alpha=alpha,
+            s=props["s"],
+            facecolors=props["facecolors"],
+            # Apply edgecolors only if specified (for hollow markers)
+            **({"edgecolors": props["edgecolors"]} if "edgecolors" in props else {}),
+            linewidths=props["linewidths"],
+        )
+
+
 def plot_algorithm_results(
     X,
     y,
@@ -55,38 +83,12 @@ def plot_algorithm_results(
     fig, axs = plt.subplots(1, 2, figsize=(14, 7))  # Slightly larger figure for clarity
 
     # Plot the original dataset
-    for label in np.unique(y):
-        props = marker_properties[label]
-        axs[0].scatter(
-            X[y == label][:, 0],
-            X[y == label][:, 1],
-            label=f"Class {label}",
-            marker=props["marker"],
-            alpha=alpha,
-            s=props["s"],
-            facecolors=props["facecolors"],
-            # Apply edgecolors only if specified (for hollow markers)
-            **({"edgecolors": props["edgecolors"]} if "edgecolors" in props else {}),
-            linewidths=props["linewidths"],
-        )
+    _plot_one(axs[0], X, y, marker_properties, alpha)
     axs[0].set_title("Original Dataset")
     axs[0].legend()
 
     # Plot the reduced dataset
-    for label in np.unique(y_):
-        props = marker_properties[label]
-        axs[1].scatter(
-            X_[y_ == label][:, 0],
-            X_[y_ == label][:, 1],
-            label=f"Class {label}",
-            marker=props["marker"],
-            alpha=alpha,
-            s=props["s"],
-            facecolors=props["facecolors"],
-            # Apply edgecolors only if specified (for hollow markers)
-            **({"edgecolors": props["edgecolors"]} if "edgecolors" in props else {}),
-            linewidths=props["linewidths"],
-        )
+    _plot_one(axs[1], X_, y_, marker_properties, alpha)
     # Ensure the same scale for both subplots
     axs[1].set_xlim(axs[0].get_xlim())
     axs[1].set_ylim(axs[0].get_ylim())